@@ -1,36 +1,284 @@
 import pandas as pd
-import xml.etree.ElementTree as ET
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from lxml import etree
 import os
+import sys
+import mmap
 import logging
 from collections import defaultdict
 import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm 
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, FrozenSet, Tuple, Callable, Union, BinaryIO
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Top-level records are indented by a single space in the export, nested ones
+# (e.g. inside a Correlation) are indented further.
+_RECORD_MARKER = b"\n <Record "
+_ROOT_TAG = "HealthData"
+_ROOT_CLOSE = b"</HealthData>"
+# Bytes handed to the parser per read, also used as the file buffer size
+_FEED_SIZE = 1 << 20
+# Progress is reported every _PBAR_BATCH elements, must be a power of two
+_PBAR_BATCH = 1 << 14
+# Attributes with few distinct values, which are stored once and shared by all rows
+_CATEGORICAL_COLUMNS = frozenset(("type", "sourceName", "sourceVersion", "unit"))
+
+def _to_table(cols: Dict[str, List[Any]]) -> pa.Table:
+    """Builds a pyarrow Table from the columns of a tag, dictionary-encoding categorical columns.
+
+    Args:
+        cols (Dict[str, List[Any]]): The attribute values of a tag, one list per attribute.
+
+    Returns:
+        pa.Table: The table with one column per attribute.
+    """
+    arrays = {}
+    for name, values in cols.items():
+        array = pa.array(values, type=pa.string())
+        arrays[name] = array.dictionary_encode() if name in _CATEGORICAL_COLUMNS else array
+    return pa.table(arrays)
+
+
+def _write_csv(tag: str, cols: Dict[str, List[Any]], output_dir: str) -> None:
+    """Writes the rows of a single tag to its CSV file.
+
+    Args:
+        tag (str): The tag whose rows are written, used as the file name.
+        cols (Dict[str, List[Any]]): The attribute values of this tag, one list per attribute.
+        output_dir (str): The directory where the CSV file will be saved.
+    """
+    table = _to_table(cols)
+    csv_file_path = os.path.join(output_dir, f"{tag}.csv")
+    pacsv.write_csv(table, csv_file_path, write_options=pacsv.WriteOptions(include_header=True))
+
+
+def _write_parquet(tag: str, cols: Dict[str, List[Any]], output_dir: str) -> None:
+    """Writes the rows of a single tag to its zstd-compressed Parquet file.
+
+    Args:
+        tag (str): The tag whose rows are written, used as the file name.
+        cols (Dict[str, List[Any]]): The attribute values of this tag, one list per attribute.
+        output_dir (str): The directory where the Parquet file will be saved.
+    """
+    table = _to_table(cols)
+    parquet_file_path = os.path.join(output_dir, f"{tag}.parquet")
+    pq.write_table(table, parquet_file_path, compression="zstd", compression_level=3)
+
+
+class _Target:
+    """lxml parser target collecting the attributes of each element by tag.
+
+    lxml dispatches the callbacks straight from the C parser, so no Element
+    objects are built for the document. The target only defines ``start``:
+    lxml does not dispatch the callbacks a target lacks, so element ends and
+    text never reach Python. Attributes are stored column-wise:
+    every tag maps to one list per attribute name, padded with None for rows
+    that lack the attribute.
+
+    Each tag is handled by a function generated for the attributes seen so far
+    on that tag, which appends straight to the bound column lists. Apple Health
+    uses a small set of tags with a mostly fixed schema, so the handler is only
+    regenerated when a new attribute shows up. Attribute names are interned, and
+    values of ``_CATEGORICAL_COLUMNS`` are deduplicated so that millions of rows
+    share the same few string objects.
+
+    Attributes:
+        include (FrozenSet[str], optional): Tags to collect. If None, all tags are collected.
+        out (defaultdict): Mapping of tag to its attribute columns.
+        rows (defaultdict): Number of rows collected so far for each tag.
+        handlers (Dict[str, Callable]): The generated handler of each tag.
+        interned (defaultdict): Mapping of categorical column name to its distinct values.
+        count (int): Number of elements seen so far.
+        pbar (tqdm, optional): Progress bar advanced every ``_PBAR_BATCH`` elements.
+    """
+
+    def __init__(self, include: Optional[FrozenSet[str]], out: Dict[str, Dict[str, List[Any]]], rows: Dict[str, int], pbar: Optional[tqdm] = None) -> None:
+        self.include = include
+        self.out = out
+        self.rows = rows
+        self.handlers: Dict[str, Callable[[Dict[str, str]], None]] = {}
+        self.interned: Dict[str, Dict[str, str]] = defaultdict(dict)
+        self.count = 0
+        self.pbar = pbar
+        # Pick the start callback once, so that collecting every tag skips the filter entirely
+        self.start = self._start_all if include is None else self._start_included
+
+    def _start_all(self, tag: str, attrib: Dict[str, str]) -> None:
+        handler = self.handlers.get(tag) or self._compile(tag)
+        handler(attrib)
+        self.rows[tag] += 1
+        self.count += 1
+        if not self.count & (_PBAR_BATCH - 1) and self.pbar is not None:
+            self.pbar.update(_PBAR_BATCH)
+
+    def _start_included(self, tag: str, attrib: Dict[str, str]) -> None:
+        if tag in self.include:
+            handler = self.handlers.get(tag) or self._compile(tag)
+            handler(attrib)
+            self.rows[tag] += 1
+        self.count += 1
+        if not self.count & (_PBAR_BATCH - 1) and self.pbar is not None:
+            self.pbar.update(_PBAR_BATCH)
+
+    def _compile(self, tag: str) -> Callable[[Dict[str, str]], None]:
+        """Generates the handler appending a row of ``tag`` to its known columns.
+
+        The handler pops every known attribute from the row, appending None when
+        it is missing, and passes any leftover attribute to ``_add_columns``.
+
+        Args:
+            tag (str): The tag to generate the handler for.
+
+        Returns:
+            Callable[[Dict[str, str]], None]: The handler, also stored in ``handlers``.
+        """
+        params, body = [], []
+        for i, name in enumerate(self.out[tag]):
+            params.append(f", _c{i}=_cols[{name!r}].append")
+            if name in _CATEGORICAL_COLUMNS:
+                params.append(f", _d{i}=_interned[{name!r}].setdefault")
+                body.append(f"    value = attrib.pop({name!r}, None)\n    _c{i}(_d{i}(value, value))\n")
+            else:
+                body.append(f"    _c{i}(attrib.pop({name!r}, None))\n")
+        source = f"def _handle(attrib, _new=_new{''.join(params)}):\n{''.join(body)}    if attrib:\n        _new(attrib)\n"
+        namespace = {"_cols": self.out[tag], "_interned": self.interned, "_new": partial(self._add_columns, tag)}
+        exec(source, namespace)
+        handler = self.handlers[tag] = namespace["_handle"]
+        return handler
+
+    def _add_columns(self, tag: str, attrib: Dict[str, str]) -> None:
+        """Adds columns for attributes first seen on the current row and regenerates the handler.
+
+        Args:
+            tag (str): The tag of the current row.
+            attrib (Dict[str, str]): The attributes of the row that have no column yet.
+        """
+        cols = self.out[tag]
+        n = self.rows[tag]
+        for key, value in attrib.items():
+            if key in _CATEGORICAL_COLUMNS:
+                value = self.interned[key].setdefault(value, value)
+            # Pad the previous rows, which lack the attribute
+            cols[sys.intern(key)] = [None] * n + [value]
+        self._compile(tag)
+
+    def close(self) -> None:
+        if self.pbar is not None:
+            self.pbar.update(self.count & (_PBAR_BATCH - 1))
+        return None
+
+
+def _feed(parser: etree.XMLParser, stream: BinaryIO) -> None:
+    """Feeds a whole binary stream to a parser in ``_FEED_SIZE`` reads and closes the parser.
+
+    Args:
+        parser (etree.XMLParser): The parser to feed.
+        stream (BinaryIO): The stream to read the document from.
+    """
+    while buf := stream.read(_FEED_SIZE):
+        parser.feed(buf)
+    parser.close()
+
+
+def _split_chunks(mm: mmap.mmap, n: int) -> List[Tuple[int, int]]:
+    """Splits the body of the export into about n byte ranges of whole top-level elements.
+
+    Every range starts on a top-level ``<Record`` and the last one ends on the
+    closing root tag, so each range can be parsed on its own.
+
+    Args:
+        mm (mmap.mmap): The memory-mapped XML file.
+        n (int): The number of ranges to aim for.
+
+    Returns:
+        List[Tuple[int, int]]: The ``(start, end)`` byte offsets of each range, empty if the file has no records.
+    """
+    first = mm.find(_RECORD_MARKER)
+    last = mm.rfind(_ROOT_CLOSE)
+    if first == -1 or last < first:
+        return []
+
+    bounds = [first + 1]
+    step = (last - first) // n
+    for i in range(1, n):
+        pos = mm.find(_RECORD_MARKER, max(first + i * step, bounds[-1]), last)
+        if pos == -1:
+            break
+        bounds.append(pos + 1)
+    bounds.append(last)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _parse_chunk(xml_file: str, start: int, end: int, include: Optional[FrozenSet[str]]) -> Tuple[Dict[str, Dict[str, List[Any]]], Dict[str, int]]:
+    """Parses a byte range of the export made of whole elements.
+
+    The range starting at 0 holds the prolog and the opening root tag, which is
+    closed here. Any other range is wrapped in a synthetic root element that is
+    dropped from the result.
+
+    Args:
+        xml_file (str): The path to the Apple Health XML file.
+        start (int): Offset of the first byte of the range.
+        end (int): Offset past the last byte of the range.
+        include (FrozenSet[str], optional): Tags to collect. If None, all tags are collected.
+
+    Returns:
+        Tuple[Dict[str, Dict[str, List[Any]]], Dict[str, int]]: The attribute columns and row count of each tag.
+
+    Raises:
+        ValueError: If the range is not well-formed. lxml's XMLSyntaxError cannot
+            be pickled back to the parent process, so its message is carried instead.
+    """
+    out: Dict[str, Dict[str, List[Any]]] = defaultdict(dict)
+    rows: Dict[str, int] = defaultdict(int)
+    parser = etree.XMLParser(target=_Target(include, out, rows))
+    try:
+        if start:
+            parser.feed(f"<{_ROOT_TAG}>".encode())
+        with open(xml_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(start, end, _FEED_SIZE):
+                parser.feed(mm[pos:min(pos + _FEED_SIZE, end)])
+        parser.feed(_ROOT_CLOSE)
+        parser.close()
+    except etree.XMLSyntaxError as e:
+        # Line numbers are relative to the range, so report where it starts
+        raise ValueError(f"{e} (in the chunk starting at byte {start})") from None
+
+    if start:
+        out.pop(_ROOT_TAG, None)
+        rows.pop(_ROOT_TAG, None)
+    return out, rows
+
+
 class AppleHealthExporter:
-    """A class to convert Apple Health XML data into CSV format.
+    """A class to convert Apple Health XML data into CSV or Parquet format.
 
     This class parses an Apple Health XML file, counts the occurrences of each tag,
-    and saves the attributes of these tags into separate CSV files.
+    and saves the attributes of these tags into separate CSV or Parquet files.
     
     Attributes:
-        xml_file (str): The path to the Apple Health XML file to be parsed.
-        output_dir (str): The directory where the CSV files will be saved.
-        tag_count (defaultdict): Counts of each tag and their attributes.
+        xml_file (Union[str, BinaryIO]): The path to the Apple Health XML file, or a binary stream of it.
+        output_dir (str): The directory where the exported files will be saved.
+        tag_count (defaultdict): Attribute columns of each tag, one list per attribute name.
+        row_count (defaultdict): Number of rows of each tag.
     """
 
-    def __init__(self, xml_file: str, output_dir: str, include_tags: Optional[List[str]] = None) -> None:
+    def __init__(self, xml_file: Union[str, BinaryIO], output_dir: str, include_tags: Optional[List[str]] = None) -> None:
         """Initializes the AppleHealthExporter.
 
         Args:
-            xml_file (str): The path to the Apple Health XML file to be parsed.
-            output_dir (str): The directory where the CSV files will be saved.
+            xml_file (Union[str, BinaryIO]): The path to the Apple Health XML file, or a binary stream
+                of it such as an entry opened from the export ZIP file.
+            output_dir (str): The directory where the exported files will be saved.
             include_tags (List[str], optional): List of specific tags to include. If None, all tags are included.
         """
-        if not os.path.isfile(xml_file):
+        if not hasattr(xml_file, "read") and not os.path.isfile(xml_file):
             raise FileNotFoundError(f"The specified XML file does not exist: {xml_file}")
         
         if not os.path.isdir(output_dir):
@@ -38,53 +286,129 @@ class AppleHealthExporter:
         
         self.xml_file = xml_file
         self.output_dir = output_dir
-        self.tag_count: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-        self.include_tags = include_tags
+        self.tag_count: Dict[str, Dict[str, List[Any]]] = defaultdict(dict)
+        self.row_count: Dict[str, int] = defaultdict(int)
+        self.include_tags: Optional[FrozenSet[str]] = frozenset(include_tags) if include_tags is not None else None
 
     def parse_xml(self) -> None:
         """Parses the Apple Health XML file and counts occurrences of each tag with detailed logging."""
         logging.info("Parsing XML file...")
         try:
-            tree = ET.parse(self.xml_file)
-            root = tree.getroot()
-        except ET.ParseError as e:
+            if hasattr(self.xml_file, "read"):
+                chunks = []  # A stream cannot be memory-mapped, parse it in a single pass
+            else:
+                with open(self.xml_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    chunks = _split_chunks(mm, os.cpu_count() or 1)
+
+            if len(chunks) > 1:
+                self._parse_parallel(chunks)
+            else:
+                with tqdm(desc="Processing elements", unit="element") as pbar:
+                    parser = etree.XMLParser(target=_Target(self.include_tags, self.tag_count, self.row_count, pbar))
+                    if hasattr(self.xml_file, "read"):
+                        _feed(parser, self.xml_file)
+                    else:
+                        # libxml2 reads files in small blocks on its own, read 1MB at a time instead
+                        with open(self.xml_file, "rb", buffering=_FEED_SIZE) as f:
+                            _feed(parser, f)
+        except (etree.XMLSyntaxError, ValueError) as e:  # ValueError is a syntax error raised in a worker
             logging.error(f"Error parsing XML file: {e}")
+            self._reset()  # Drop the rows streamed before the error
             return  # Exit if XML is not well-formed
         except Exception as e:
             logging.error(f"An unexpected error occurred: {e}")
+            self._reset()
             return  # Exit on unexpected error
 
-        # Count tags
-        logging.info("Counting tags in XML...")
-        unique_tags = set()
-        for element in tqdm(root.iter(), desc="Processing elements", unit="element"):
-            if self.include_tags is None or element.tag in self.include_tags:
-                self.tag_count[element.tag].append(element.attrib)
-                unique_tags.add(element.tag)
+        logging.info(f"Found {len(self.tag_count)} unique tags in the XML file.")
+
+    def _reset(self) -> None:
+        """Discards the rows collected so far, so that a failed parse yields no data."""
+        self.tag_count = defaultdict(dict)
+        self.row_count = defaultdict(int)
 
-        logging.info(f"Found {len(unique_tags)} unique tags in the XML file.")
+    def _parse_parallel(self, chunks: List[Tuple[int, int]]) -> None:
+        """Parses the prolog and the given byte ranges in worker processes and merges the results.
+
+        Args:
+            chunks (List[Tuple[int, int]]): The byte ranges returned by ``_split_chunks``.
+        """
+        ranges = [(0, chunks[0][0])] + chunks
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(_parse_chunk, self.xml_file, start, end, self.include_tags) for start, end in ranges]
+            # Merge in submission order to keep the rows in document order
+            for i in tqdm(range(len(futures)), desc="Processing chunks", unit="chunk"):
+                self._merge(*futures[i].result())
+                # The future holds the chunk's columns, release them once merged
+                futures[i] = None
+
+    def _merge(self, cols_part: Dict[str, Dict[str, List[Any]]], rows_part: Dict[str, int]) -> None:
+        """Appends the columns parsed from one chunk to ``tag_count``.
+
+        Args:
+            cols_part (Dict[str, Dict[str, List[Any]]]): The attribute columns of each tag in the chunk.
+            rows_part (Dict[str, int]): The row count of each tag in the chunk.
+        """
+        for tag, m in rows_part.items():
+            cols = self.tag_count[tag]
+            part = cols_part[tag]
+            n = self.row_count[tag]
+            for key, values in part.items():
+                col = cols.get(key)
+                if col is None:
+                    col = cols[key] = [None] * n
+                col.extend(values)
+            for key in cols.keys() - part.keys():
+                cols[key].extend([None] * m)
+            self.row_count[tag] = n + m
+
+    def get_dataframes(self) -> Dict[str, pd.DataFrame]:
+        """Returns the parsed data as DataFrames without writing anything to disk.
+
+        Returns:
+            Dict[str, pd.DataFrame]: One DataFrame per tag, with one column per attribute.
+                Columns with few distinct values, such as ``type`` or ``unit``, are categorical.
+        """
+        return {
+            tag: pd.DataFrame({
+                name: pd.Categorical(values) if name in _CATEGORICAL_COLUMNS else values
+                for name, values in cols.items()
+            })
+            for tag, cols in self.tag_count.items()
+        }
 
     def create_output_directory(self) -> None:
-        """Creates the output directory for CSV files if it doesn't already exist."""
+        """Creates the output directory for the exported files if it doesn't already exist."""
         os.makedirs(self.output_dir, exist_ok=True)
         logging.info(f"Output directory '{self.output_dir}' is ready.")
 
     def save_to_csv(self) -> None:
         """Processes tags and generates corresponding CSV files."""
-        total_rows = 0
-        
-        logging.info("Processing tags and generating CSV files...")
-        for tag, attribs in self.tag_count.items():
-            tag_rows = len(attribs)
-            total_rows += tag_rows
-            
+        self._save(_write_csv, "CSV")
+
+    def save_to_parquet(self) -> None:
+        """Processes tags and generates corresponding Parquet files."""
+        self._save(_write_parquet, "Parquet")
+
+    def _save(self, writer: Callable[[str, Dict[str, List[Any]], str], None], file_type: str) -> None:
+        """Writes one file per tag with the given writer.
+
+        Args:
+            writer (Callable): Module-level function writing the columns of one tag to ``output_dir``.
+            file_type (str): Name of the file type, for logging.
+        """
+        total_rows = sum(self.row_count.values())
+
+        logging.info(f"Processing tags and generating {file_type} files...")
+        for tag in self.tag_count:
             # Prepare and log row for summary immediately
-            logging.info(f"{tag:<40} {tag_rows:>40}")
+            logging.info(f"{tag:<40} {self.row_count[tag]:>40}")
 
-            # Save to CSV
-            df = pd.DataFrame(attribs)
-            csv_file_path = os.path.join(self.output_dir, f"{tag}.csv")
-            df.to_csv(csv_file_path, index=False)
+        # Each tag goes to its own file, so the writes are independent
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(writer, tag, cols, self.output_dir) for tag, cols in self.tag_count.items()]
+            for future in as_completed(futures):
+                future.result()
 
         # Log total row count
         self.log_summary(total_rows)
@@ -99,13 +423,23 @@ class AppleHealthExporter:
         logging.info(separator)
         logging.info(f"{'Total number of rows :':<40} {total_rows:>40}")
 
-    def convert(self) -> None:
-        """Orchestrates the Apple Health XML to CSV conversion process."""
+    def convert(self, file_format: str = "csv") -> None:
+        """Orchestrates the Apple Health XML to CSV or Parquet conversion process.
+
+        Args:
+            file_format (str): Format of the exported files, either "csv" or "parquet".
+        """
+        if file_format not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported file format: {file_format}")
+
         start_time = time.time()
         
         self.create_output_directory()
         self.parse_xml()
-        self.save_to_csv()
+        if file_format == "parquet":
+            self.save_to_parquet()
+        else:
+            self.save_to_csv()
 
         # Calculate and log the execution time
         end_time = time.time()
@@ -115,14 +449,15 @@ class AppleHealthExporter:
 
 if __name__ == "__main__":
     xml_file_path = 'data/apple_health_export/export.xml'
-    csv_output_dir = 'data/apple_health_export/csv_output'
+    file_format = 'parquet'  # Set to 'csv' to export CSV files instead
+    output_dir = f'data/apple_health_export/{file_format}_output'
     
     # Optional: Specify which tags to include
     include_tags = None  # Set to a list of tags to include, or None for all tags
     
     try:
-        converter = AppleHealthExporter(xml_file_path, csv_output_dir, include_tags)
-        converter.convert()
+        converter = AppleHealthExporter(xml_file_path, output_dir, include_tags)
+        converter.convert(file_format)
     except FileNotFoundError as e:
         logging.error(e)
     except Exception as e:
@@ -1,65 +1,82 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import io
 import zipfile
-import os
+import tempfile
 import logging
-import matplotlib.pyplot as plt
 from apple_health_exporter import AppleHealthExporter 
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - Line %(lineno)d - %(message)s')
 
-# Function to extract ZIP file
-def extract_zip(uploaded_file):
-    logging.info("Starting extraction of ZIP file.")
-    with zipfile.ZipFile(uploaded_file, 'r') as zip_ref:
-        zip_ref.extractall("temp_data/")
-        export_file = os.path.join("temp_data/apple_health_export/", 'export.xml')
-        logging.info(f"Looking for export.xml at {export_file}.")
-        if os.path.exists(export_file):
-            logging.info("export.xml found.")
-            return export_file
+# Function to find export.xml in the ZIP file, which is read in place rather than extracted
+def find_export_xml(zip_ref):
+    export_file = "apple_health_export/export.xml"
+    logging.info(f"Looking for {export_file} in the ZIP file.")
+    if export_file in zip_ref.namelist():
+        logging.info("export.xml found.")
+        return export_file
     logging.warning("export.xml not found in the ZIP file.")
     return None
 
-# Function to convert XML to CSV
-def convert_xml_to_csv(xml_file_path, csv_output_dir, include_tags):
+# Function to parse the XML into one DataFrame per tag, without writing CSV files
+def load_xml_data(xml_file, output_dir, include_tags):
     try:
-        logging.info(f"Converting XML file {xml_file_path} to CSV.")
-        converter = AppleHealthExporter(xml_file_path, csv_output_dir, include_tags)
-        converter.convert()
-        logging.info("Conversion successful.")
-        return os.listdir(csv_output_dir)
+        logging.info("Parsing XML data.")
+        converter = AppleHealthExporter(xml_file, output_dir, include_tags)
+        converter.parse_xml()
+        logging.info("Parsing successful.")
+        return converter.get_dataframes()
     except FileNotFoundError as e:
         logging.error(f"FileNotFoundError: {e}")
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
-    return []
+    return {}
 
 # Function to preprocess the data
-def preprocess_data(files):
+def preprocess_data(dataframes):
     logging.info("Starting data preprocessing.")
-    combined_data = pd.DataFrame()
-    for file in files:
-        logging.info(f"Reading file: {file}")
-        data = pd.read_csv(f"data/apple_health_export/csv_output/{file}")
-        combined_data = pd.concat([combined_data, data], ignore_index=True)  
+    for tag in dataframes:
+        logging.info(f"Combining tag: {tag}")
+    # Concatenate all tags at once, a single copy of the data
+    combined_data = pd.concat(dataframes.values(), ignore_index=True, copy=False)
     logging.info("Data preprocessing completed.")
     return combined_data
 
+# Function to run the whole pipeline on an upload, cached on its content so that reruns skip it
+@st.cache_data(max_entries=2, show_spinner=False)
+def parse_upload(file_bytes):
+    with zipfile.ZipFile(io.BytesIO(file_bytes), 'r') as zip_ref:
+        export_file = find_export_xml(zip_ref)
+        if not export_file:
+            return None, None
+
+        # Nothing is exported, the output directory only lives for the parse and is removed on exit
+        with tempfile.TemporaryDirectory() as output_dir:
+            # Decompress straight into the parser, in 1MB reads
+            with zip_ref.open(export_file) as xml_stream:
+                dataframes = load_xml_data(io.BufferedReader(xml_stream, buffer_size=1 << 20), output_dir, None)
+    data = preprocess_data(dataframes) if dataframes else None
+    return dataframes, data
+
+# Function to compute the histogram of the steps, cached on a cheap key since hashing the whole column is slow
+@st.cache_data(max_entries=4, show_spinner=False)
+def steps_histogram(_steps, key):
+    steps = pd.to_numeric(_steps, errors='coerce').dropna()
+    counts, edges = np.histogram(steps, bins=20)
+    return pd.Series(counts, index=pd.Index(edges[:-1], name='Steps'), name='Frequency')
+
 # Function to visualize data
 def visualize_data(data):
     st.subheader("Data Overview")
     st.write(data.head())  # Show first few rows of data
 
     # Example visualization: Histogram of a column (modify this based on your data)
-    if 'steps' in data.columns:
-        plt.figure(figsize=(10, 5))
-        plt.hist(data['steps'], bins=20, color='skyblue', edgecolor='black')
-        plt.title('Distribution of Steps')
-        plt.xlabel('Steps')
-        plt.ylabel('Frequency')
-        st.pyplot(plt)
+    if 'steps' in data.columns and not data.empty:
+        st.subheader('Distribution of Steps')
+        key = (data.shape, data['steps'].iloc[0], data['steps'].iloc[-1])
+        st.bar_chart(steps_histogram(data['steps'], key))
 
 # Main Streamlit app
 def main():
@@ -69,41 +86,20 @@ def main():
 
     if uploaded_file is not None:
         logging.info("A file has been uploaded.")
-        st.write("Extracting data...")
-        xml_file = extract_zip(uploaded_file)
-
-        if xml_file:
-            st.write("Converting XML data to CSV...")
-            csv_files = []
-            xml_file_path = xml_file
-            csv_output_dir = "data/apple_health_export/csv_output"  # Ensure this directory exists
-            os.makedirs(csv_output_dir, exist_ok=True)
-            
-            csv_files += convert_xml_to_csv(xml_file_path, csv_output_dir, None)
-
-            if csv_files:
-                st.write("Preprocessing data...")
-                data = preprocess_data(csv_files)
-
-                st.success("Data loaded successfully!")
-                visualize_data(data)
+        with st.spinner("Loading data..."):
+            dataframes, data = parse_upload(uploaded_file.getvalue())
 
-            else:
-                st.error("No CSV files were generated from the XML.")
-                logging.error("No CSV files were generated.")
-
-        else:
+        if dataframes is None:
             st.error("No XML files found in the ZIP archive.")
             logging.error("No XML files found in the ZIP archive.")
 
-    # Clean up extracted files
-    if os.path.exists("temp_data/"):
-        logging.info("Cleaning up extracted files.")
-        for file in os.listdir("temp_data/"):
-            file_path = os.path.join("temp_data/", file)
-            if os.path.isfile(file_path):  # Check if it is a file before removing
-                os.remove(file_path)
-        os.rmdir("temp_data/")
+        elif dataframes:
+            st.success("Data loaded successfully!")
+            visualize_data(data)
+
+        else:
+            st.error("No data was found in the XML.")
+            logging.error("No data was parsed from the XML.")
 
 if __name__ == "__main__":
     main()